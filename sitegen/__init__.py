@@ -1,4 +1,4 @@
-from .build import Page, build
+from .build import Page, BuildFailure, build, build_all
 from .context import BuildContext, FileType, BuildReason
 from .exec import BuildException, FileTypeError
 from .site import SiteRoot
@@ -7,11 +7,13 @@ __version__ = "0.2.0"
 __author__ = "itsdanjc <dan@itsdanjc.com>"
 __all__ = [
     "Page",
+    "BuildFailure",
     "SiteRoot",
     "BuildContext",
     "FileType",
     "BuildReason",
     "BuildException",
     "FileTypeError",
-    "build"
+    "build",
+    "build_all"
 ]
\ No newline at end of file
@@ -1,13 +1,15 @@
 import argparse
+import functools
 import logging
+import os
 import sys
 from pathlib import Path
 from typing import Optional, Final
-from jinja2 import TemplateError
 from .log import configure_logging
-from .site import SiteRoot, TreeBuilder
-from .build import build as build_page
+from .site import SiteRoot, TreeBuilder, write_stream
+from .build import BuildFailure, build_all
 from .cli import BuildStats
+from .context import BuildContext, BuildReason, FileType, MODIFIED_REASONS
 from . import __version__, __author__
 
 CLI_NAME = "sitegen"
@@ -15,9 +17,9 @@ CLI_HEADER_MSG: Final[str] = f"{CLI_NAME} {__version__}, by {__author__}"
 CLI_DESC: Final[str] = "Epilogue"
 
 logger = logging.getLogger(__name__)
-cwd = Path.cwd()
 
-def main(argv: Optional[list[str]] = None) -> None:
+@functools.cache
+def build_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser(prog=CLI_NAME, description=CLI_DESC)
     commands = parser.add_subparsers(title="commands", dest="commands", required=True)
 
@@ -43,9 +45,14 @@ def main(argv: Optional[list[str]] = None) -> None:
         "--no-sitemap", action="store_true",
         help="do not update sitemap feed.")
     build_cmd.add_argument(
-        "-r", "--site-root", type=Path, default=cwd, metavar="PATH",
+        "-r", "--site-root", type=Path, default=None, metavar="PATH",
         help="location of webroot, if not at the current working directory")
 
+    return parser
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = build_parser()
     args = parser.parse_args(argv)
     print(CLI_HEADER_MSG, end="\n\n")
     configure_logging(args.verbose)
@@ -53,7 +60,7 @@ def main(argv: Optional[list[str]] = None) -> None:
         if args.commands == "build":
             build(
                 args.force,
-                args.site_root,
+                args.site_root or Path.cwd(),
                 args.clean,
                 args.dry_run,
                 args.no_rss,
@@ -72,53 +79,103 @@ def build(
         no_rss: bool,
         no_sitemap: bool
 ) -> None:
-    site = SiteRoot(directory.resolve())
+    site = SiteRoot(Path(os.path.abspath(directory)))
     logger.info("Building site at %s", site.root)
 
     with BuildStats() as build_stats:
-        logger.info("Indexing source directory.")
-        TreeBuilder(site)
-
         if perform_clean:
             logger.info("Performing cleanup.")
             site.clean_dest()
 
+        logger.info("Indexing source directory.")
+        tree_builder = TreeBuilder(site)
+
+        to_build: list[tuple[BuildContext, BuildReason]] = []
+        index_cache = site.index_cache
+
+        # Checked once, rather than per page, as most records are dropped.
+        info_enabled = logger.isEnabledFor(logging.INFO)
+        debug_enabled = logger.isEnabledFor(logging.DEBUG)
+
         for context in site.tree:
-            name = context.source_path.name
             context.validate_only = dry_run
 
-            modified = (context.is_modified or force or dry_run)
+            # build_reason stats the destination, so read it only once.
+            build_reason = context.build_reason
+            modified = (force or dry_run or build_reason in MODIFIED_REASONS)
             if not modified:
-                logger.debug("Found unmodified %s", name)
+                if debug_enabled:
+                    logger.debug("Found unmodified %s", context.source_name)
+                if (
+                    context.index_entry is None
+                    or context.index_entry.mtime_ns != context.source_mtime_ns
+                ):
+                    index_cache.update(context)
                 continue
 
-            logger.info("Building page %s", name)
+            if info_enabled:
+                logger.info("Building page %s", context.source_name)
+            to_build.append((context, build_reason))
 
-            try:
-                build_page(context)
-            except (OSError, TemplateError, FileExistsError) as e:
+        # Dry runs only validate, so are not worth the cost of pickling.
+        results = build_all([context for context, _ in to_build], processes=not dry_run)
+
+        for (context, build_reason), result in zip(to_build, results):
+            if isinstance(result, BuildFailure):
                 build_stats.errors += 1
-                logger.exception("Failed to build", exc_info=e)
+                index_cache.mark_failed(context.cache_key)
+                # Tracebacks are only shown when debugging.
+                if debug_enabled:
+                    logger.error(
+                        "Failed to build %s: %s\n%s", context.source_name,
+                        result.error, result.traceback.rstrip()
+                    )
+                else:
+                    logger.error(
+                        "Failed to build %s: %s", context.source_name, result.error
+                    )
                 continue
 
-            logger.info("Build OK")
-            build_stats.add_stat(context.build_reason)
+            if not result:
+                # Skipped, and already logged by build(). Left out of the
+                # index, so drafts are checked, and counted, every build.
+                index_cache.discard(context.cache_key)
+                if context.type != FileType.MARKDOWN:
+                    continue
+
+                build_stats.draft += 1
+                # A page made a draft after it was built must not stay live.
+                if not dry_run and site.delete_output(context.dest_path):
+                    logger.info("Deleted %s, page is a draft", context.dest_path)
+                    build_stats.add_stat(BuildReason.DELETED)
+                continue
 
-        if not (no_rss or dry_run):
-            rss = site.make_rss()
-            rss_path = site.dest_dir.joinpath("feed.xml")
+            if info_enabled:
+                logger.info("Build %s OK", context.source_name)
+            build_stats.add_stat(build_reason)
+            index_cache.update(context)
 
-            rss_path.parent.mkdir(exist_ok=True)
-            with rss_path.open("w") as out:
-                out.write(rss)
+        if not dry_run:
+            deleted = index_cache.prune(
+                {context.cache_key for context in site.tree},
+                keep_under=tree_builder.failed_dirs
+            )
+            for _ in site.delete_outputs(deleted):
+                build_stats.add_stat(BuildReason.DELETED)
 
-        if not (no_sitemap or dry_run):
-            sitemap = site.make_sitemap()
-            sitemap_path = site.dest_dir.joinpath("sitemap.xml")
+            try:
+                index_cache.save()
+            except OSError as e:
+                logger.warning("Failed to save index cache: %s", e)
+
+        if not ((no_rss and no_sitemap) or dry_run):
+            site.dest_dir.mkdir(parents=True, exist_ok=True)
 
-            sitemap_path.parent.mkdir(exist_ok=True)
-            with sitemap_path.open("w") as out:
-                out.write(sitemap)
+        if not (no_rss or dry_run):
+            write_stream(site.dest_dir.joinpath("feed.xml"), site.make_rss())
+
+        if not (no_sitemap or dry_run):
+            write_stream(site.dest_dir.joinpath("sitemap.xml"), site.make_sitemap())
 
     logger.info(build_stats.summary())
 
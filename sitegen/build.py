@@ -1,27 +1,205 @@
 from __future__ import annotations
 import logging
+import os
 import re
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timezone
 from io import TextIOWrapper
-from charset_normalizer import from_path
+from pathlib import Path
+import yaml
+from charset_normalizer import from_bytes
 from marko import Markdown, MarkoExtension
 from marko.block import Document, Heading
-from jinja2 import Environment, Template
-from typing import Iterable, Final, Any
+from jinja2 import Environment, Template, TemplateError, TemplateNotFound
+from typing import Iterable, Iterator, NamedTuple, Sequence, Final, Any
+from weakref import WeakKeyDictionary
 from markupsafe import Markup
 from .exec import FileTypeError
 from .context import BuildContext, TemplateContext, FileType
 from .templates import PAGE_FALLBACK
 
+try:
+    # Use libyaml if PyYAML was built with it, it is many times faster.
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
 logger = logging.getLogger(__name__)
 
 PAGE_DEFAULT: Final[str] = "# {heading}\n{body}"
 PAGE_DEFAULT_BODY: Final[str] = "*Nothing here yet...*"
 
 DEFAULT_EXTENSIONS: Final[frozenset[str]] = frozenset(
-    {'footnote', 'toc', 'codehilite', 'gfm'}
+    {'footnote', 'toc', 'sitegen.highlight', 'gfm'}
+)
+
+# Large enough to hold most pages, so each is written in one physical write.
+WRITE_BUFFER_SIZE: Final[int] = 1 << 20
+
+# Output is written beside the destination with this suffix, then renamed
+# over it, so an interrupted or failed write never leaves a partial file.
+TEMP_SUFFIX: Final[str] = ".tmp"
+
+# Errors that fail a single page, rather than the whole build.
+BUILD_ERRORS: Final[tuple[type[Exception], ...]] = (
+    OSError, TemplateError, yaml.YAMLError
+)
+
+# Formatted by hand, as strftime("%b") would depend on the locale.
+MONTH_ABBR: Final[tuple[str, ...]] = (
+    "Jan", "Feb", "Mar", "Apr", "May", "Jun",
+    "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"
+)
+
+# Front matter is a YAML block at the start of a page, between two of these.
+FRONT_MATTER_DELIMITER: Final[str] = "---"
+
+# Checked in order, so longer marks must come first.
+BYTE_ORDER_MARKS: Final[tuple[tuple[bytes, str], ...]] = (
+    (b"\xef\xbb\xbf", "utf-8-sig"),
+    (b"\xff\xfe", "utf-16"),
+    (b"\xfe\xff", "utf-16"),
 )
 
+# re.compile returns the pattern unchanged if marko already compiled it.
+HEADING_PATTERN: Final[re.Pattern[str]] = re.compile(Heading.pattern)
+DEFAULT_TITLE: Final[Heading] = Heading(HEADING_PATTERN.match("# Heading"))
+
+# Names of the templates each environment does not have, so they are not
+# searched for again by every page. Holds no templates, as each refers back
+# to its environment, which would then never be freed.
+_templates_missing: WeakKeyDictionary[Environment, set[str]] = WeakKeyDictionary()
+_worker_env: Environment | None = None
+_thread_local = threading.local()
+
+
+class BuildFailure(NamedTuple):
+    """
+    A page that failed to build, as returned by ``build_all()``.
+    The traceback is formatted where the error was raised, as it does not
+    survive being sent back from a worker process.
+    """
+    error: BaseException
+    traceback: str
+
+
+def detect_encoding(data: bytes) -> str | None:
+    """
+    Return the encoding given by the byte order mark at the start of
+    ``data``, if any.
+    """
+    for bom, encoding in BYTE_ORDER_MARKS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+def decode_source(data: bytes) -> str:
+    """
+    Decode the contents of a source file.
+
+    Uses the encoding of the byte order mark, else UTF-8. Only if that fails
+    is ``charset_normalizer`` used to detect the encoding, in which case
+    undecodable bytes are dropped. Line endings are normalised to ``\n``,
+    as reading in text mode would.
+    """
+    try:
+        text = data.decode(detect_encoding(data) or "utf-8")
+    except UnicodeDecodeError:
+        charset = from_bytes(data).best()
+        encoding = (charset.encoding if charset else "utf-8")
+        text = data.decode(encoding, errors="ignore")
+
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def split_front_matter(text: str) -> tuple[str, str]:
+    """
+    Split the front matter from the start of a page, if any.
+    :return: A tuple containing the yml header and the body. The header
+        is empty if the page has no front matter.
+    """
+    if not text.startswith(FRONT_MATTER_DELIMITER + "\n"):
+        return "", text
+
+    start = len(FRONT_MATTER_DELIMITER)
+    end = text.find("\n" + FRONT_MATTER_DELIMITER, start)
+    while end != -1:
+        body_start = end + len(FRONT_MATTER_DELIMITER) + 1
+        if body_start == len(text) or text[body_start] == "\n":
+            return text[start + 1:end + 1], text[body_start + 1:]
+        end = text.find("\n" + FRONT_MATTER_DELIMITER, body_start)
+
+    return "", text
+
+
+def load_metadata(yml: str) -> dict[str, Any]:
+    """
+    Load page metadata from the yml header of a page. A header with no
+    content, such as only comments, gives no metadata.
+    :raise yaml.YAMLError: The header is not valid YAML, or not a mapping.
+    """
+    if not yml.strip():
+        return dict()
+
+    metadata = yaml.load(yml, Loader=SafeLoader)
+    if metadata is None:
+        return dict()
+    if not isinstance(metadata, dict):
+        raise yaml.YAMLError("Page metadata must be a mapping.")
+    return metadata
+
+
+def format_date(date: datetime) -> str:
+    """Return ``date`` as ``strftime("%d %b %y")`` would in the C locale."""
+    return f"{date.day:02d} {MONTH_ABBR[date.month - 1]} {date.year % 100:02d}"
+
+
+def get_markdown(extensions: Iterable[str | MarkoExtension]) -> Markdown:
+    """
+    Return a ``Markdown`` instance, with its parser and renderer set up for
+    ``extensions``. Shared by every page built with the same extensions.
+    Marko is not thread-safe, so one instance is kept per thread.
+    """
+    key = tuple(extensions)
+    instances = _thread_local.__dict__.setdefault("markdown", {})
+
+    markdown = instances.get(key)
+    if markdown is None:
+        markdown = Markdown(extensions=key)
+        markdown._setup_extensions()
+        instances[key] = markdown
+    return markdown
+
+
+def get_template(env: Environment, name: str, fallback: Template) -> Template:
+    """
+    Return the template ``name`` of ``env``, or ``fallback`` if there is
+    none. A missing template is only searched for once per environment;
+    those found come from the environment's own cache.
+    """
+    missing = _templates_missing.setdefault(env, set())
+    if name in missing:
+        return fallback
+
+    try:
+        return env.get_template(name)
+    except TemplateNotFound:
+        missing.add(name)
+        return fallback
+
+
+def get_page_template(env: Environment) -> Template:
+    """
+    Return the ``page.html`` template of ``env``, or ``PAGE_FALLBACK`` if
+    there is none. Resolved once per environment, then reused by every page.
+    """
+    return get_template(env, "page.html", PAGE_FALLBACK)
+
 
 class Page(Markdown):
     """
@@ -67,81 +245,94 @@ class Page(Markdown):
 
         *See Also:* ``sitegen.build()``
         """
-        super().__init__(extensions=extensions)
+        super().__init__()
         self.context = context
 
-    def r_open(self) -> TextIOWrapper:
+        # Marko sets up the parser and renderer classes from the extensions
+        # on first use, which is costly. Adopt those of a shared instance.
+        markdown = get_markdown(extensions or ())
+        self.parser = markdown.parser
+        self.renderer = markdown.renderer
+        self._setup_done = True
+
+    def check_source(self) -> Path:
         """
-        Prepare source file for reading.
-        :return: File object as the built-in `open()` function does.
-        :raise FileTypeError: Tried to open a non markdown file.
-        :raise IOError: If source file cannot be opened for any reason.
+        Return the path of the source file.
+        :raise FileTypeError: The source is not a markdown file.
         """
         path = self.context.source_path
         if not (path.suffix.lower() in FileType.MARKDOWN.value):
             raise FileTypeError("File not a markdown file.", path.suffix)
+        return path
 
-        try:
-            charset = from_path(path).best()
-            encoding = (charset.encoding if charset else "utf-8")
-            return path.open("r", errors="ignore", encoding=encoding)
-
-        except OSError as e:
-            raise IOError(*e.args) from e
-
-    def w_open(self) -> TextIOWrapper:
+    def w_open(self, path: Path | None = None) -> TextIOWrapper:
         """
         Prepare destination file for writing.
+        :param path: File to open instead of the destination path.
         :return: File object as the built-in `open()` function does.
         :raise IOError: If source file cannot be opened for any reason.
         """
-        path = self.context.dest_path
+        if path is None:
+            path = self.context.dest_path
 
         try:
             path.parent.mkdir(parents=True, exist_ok=True)
-            return path.open("w", errors="ignore", encoding="utf-8")
+            return path.open(
+                "w", errors="ignore", encoding="utf-8", buffering=WRITE_BUFFER_SIZE
+            )
 
         except OSError as e:
             raise IOError(*e.args) from e
 
     def read(self) -> tuple[str, str]:
         """
-        Return the contents of the file as strings.
+        Return the contents of the file as strings, and load the metadata
+        from its yml header.
         :raise FileTypeError: Tried to open a non markdown file.
         :raise IOError: If source file cannot be opened for any reason.
+        :raise yaml.YAMLError: The yml header is not valid.
         :return: A tuple containing the yml header and the body.
         """
-        body: str
-        with self.r_open() as f:
-            body = f.read()
+        path = self.check_source()
+
+        # Read once, then decode in memory; no second pass for detection.
+        try:
+            data = path.read_bytes()
+        except OSError as e:
+            raise IOError(*e.args) from e
 
-        self.metadata = dict() # TODO: Parse yml at start of file.
-        return "", body
+        yml, body = split_front_matter(decode_source(data))
+        self.metadata = load_metadata(yml)
+        return yml, body
 
     def set_template(self, *templates: str | Template) -> None:
+        page_template = get_page_template(self.context.jinja_env)
+        if not templates:
+            self.template = page_template
+            return
+
         self.template = self.context.jinja_env.get_or_select_template(
-            [*templates, PAGE_FALLBACK]
+            [*templates, page_template]
         )
 
     def set_title(self) -> Heading:
-        # Set a default before attempting to get actual title
-        title = Heading(
-            re.match(Heading.pattern, "# Heading")
-        )
-
-        for e in self.body.children:
+        children = self.body.children
+        for i, e in enumerate(children):
             if isinstance(e, Heading) and e.level == 1:
-                self.body.children.remove(e) #type: ignore
-                return e
-        return title
+                return children.pop(i) #type: ignore
+        return DEFAULT_TITLE
 
-    def parse(self, default: str | None = "") -> None:
+    def parse(self, default: str | None = "", body: str | None = None) -> None:
         """
         Parse the body of this page.
         If the body of the source file is empty, will fallback to default content.
+        :param default: Content used if the body is empty.
+        :param body: Body as returned by ``read()``. If not given, the source
+            file is read.
         :return: None
         """
-        yml, body = self.read()
+        if body is None:
+            yml, body = self.read()
         self.body = super().parse(body)
 
         if len(self.body.children) == 0:
@@ -156,20 +347,25 @@ class Page(Markdown):
         self.title = self.set_title()
 
     def get_template_context(self) -> TemplateContext:
+        # The renderer is shared by every page on this thread. Render all
+        # within its context, so no state is left behind for the next page.
+        with self.renderer as renderer:
+            html = renderer.render(self.body)
+            table_of_contents = renderer.render_toc()
+            title = renderer.render_children(self.title)
+
         return TemplateContext(
-            html = Markup(
-                super().render(self.body)
-            ),
-            table_of_contents = Markup(
-                self.renderer.render_toc()
-            ),
-            title = Markup(
-                self.renderer.render_children(self.title)
-            ),
+            html = Markup(html),
+            table_of_contents = Markup(table_of_contents),
+            title = Markup(title),
             modified = self.context.source_path_lastmod,
+            modified_str = format_date(self.context.source_path_lastmod),
             yml = self.metadata,
             url=self.context.url_path,
-            now = datetime.now(timezone.utc)
+            now = (
+                self.context.jinja_env.globals.get("now")
+                or datetime.now(timezone.utc)
+            )
         )
 
     def render(self, *templates: str | Template, **jinja_context) -> None:
@@ -184,22 +380,34 @@ class Page(Markdown):
         :param jinja_context: Additional context when rendering.
         :return: None
         """
-        self.set_template(*templates, "page.html")
+        self.set_template(*templates)
         template_context = self.get_template_context()
+        stream = self.template.stream(page=template_context, **jinja_context)
 
-        with self.w_open() as f:
-            html = self.template.render(
-                page=template_context, **jinja_context
-            )
+        if self.context.validate_only:
+            # Render in full to surface any errors, but leave the file be.
+            for _ in stream:
+                pass
+            return
+
+        dest = self.context.dest_path
+        temp = dest.with_name(dest.name + TEMP_SUFFIX)
+
+        try:
+            # Written as rendered, without first joining into a single string.
+            with self.w_open(temp) as f:
+                stream.dump(f)
+            os.replace(temp, dest)
 
-            if not self.context.validate_only:
-                f.write(html)
+        except BaseException:
+            temp.unlink(missing_ok=True)
+            raise
 
 def build(
         build_context: BuildContext,
         extensions: Iterable[str | MarkoExtension] | None = None,
         **jinja_context: Any
-) -> None:
+) -> bool:
     """
     Build a page from a Markdown document.
 
@@ -209,7 +417,8 @@ def build(
     :param extensions: Optional iterable of Marko extension names or
             extension instances to enable for Markdown parsing.
     :param jinja_context: Additional context when rendering.
-    :return: None
+    :return: True if the page was built, False if it was skipped, as a
+        draft or not a Markdown file.
     """
     if not extensions:
         extensions = DEFAULT_EXTENSIONS
@@ -217,13 +426,86 @@ def build(
     if build_context.type != FileType.MARKDOWN:
         print(build_context.type)
         logger.warning("%s is not a Markdown or HTML file.", build_context.source_path.name)
-        return
+        return False
 
     page = Page(build_context, extensions)
-    page.parse(PAGE_DEFAULT_BODY)
+    yml, body = page.read()
 
+    # Checked before parsing, so drafts cost no more than reading the file.
     if page.metadata.get("is_draft", False):
         logger.info("Page %s is draft. Skipping...", build_context.source_path)
-        return
+        return False
 
+    page.parse(PAGE_DEFAULT_BODY, body)
     page.render(**jinja_context)
+    return True
+
+
+def _init_worker(env: Environment) -> None:
+    """
+    Executor initializer for ``build_all()``. Installs the environment
+    shared by every page the worker builds, so it is sent to each worker
+    once rather than with every page.
+    """
+    global _worker_env
+    _worker_env = env
+
+
+def _try_build(build_context: BuildContext) -> BuildFailure | bool:
+    try:
+        return build(build_context)
+    except BUILD_ERRORS as e:
+        return BuildFailure(e, traceback.format_exc())
+
+
+def _build_one(build_context: BuildContext) -> BuildFailure | bool:
+    build_context.jinja_env = _worker_env
+    return _try_build(build_context)
+
+
+def build_all(
+        build_contexts: Sequence[BuildContext],
+        processes: bool = True,
+        max_workers: int | None = None
+) -> Iterator[BuildFailure | bool]:
+    """
+    Build many pages in parallel, using the default extensions.
+
+    All contexts must share the same Jinja2 environment, as those from
+    a ``SiteRoot`` do.
+
+    :param build_contexts: BuildContext instances to build.
+    :param processes: Build in worker processes. If false, use threads,
+        which avoids pickling but runs Python code one thread at a time.
+    :param max_workers: Number of workers, defaults to ``os.cpu_count()``.
+        Never more than there are pages. With a single worker, pages are
+        built in this thread instead, without starting a pool.
+    :return: An iterator over the failure of each page, or the result of
+        ``build()`` if it did not fail. In the same order as
+        ``build_contexts``.
+    """
+    if not build_contexts:
+        return
+
+    # A process pool starts every worker on first use, so an incremental
+    # build of a page or two must not pay for one per CPU.
+    workers = min(max_workers or os.cpu_count() or 1, len(build_contexts))
+    if workers == 1:
+        for build_context in build_contexts:
+            yield _try_build(build_context)
+        return
+
+    executor_cls = (ProcessPoolExecutor if processes else ThreadPoolExecutor)
+    executor = executor_cls(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(build_contexts[0].jinja_env,)
+    )
+
+    # About four chunks per worker: few enough to keep pickling overhead
+    # low, enough that a worker stuck on a large page does not hold up
+    # the rest. Threads ignore chunksize.
+    chunksize = max(1, len(build_contexts) // (4 * workers))
+
+    with executor:
+        yield from executor.map(_build_one, build_contexts, chunksize=chunksize)
@@ -0,0 +1,254 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Final, Iterable, NamedTuple, Optional, TYPE_CHECKING
+from jinja2 import FileSystemBytecodeCache
+
+if TYPE_CHECKING:
+    from .context import BuildContext
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR: Final[Path] = Path(".sitegen-cache")
+INDEX_FILE: Final[str] = "index.json"
+BYTECODE_DIR: Final[str] = "jinja"
+CACHE_VERSION: Final[int] = 3
+
+# Only detects changes, so needs no cryptographic strength. BLAKE2b is
+# several times faster than SHA-256 where there are no SHA instructions.
+DIGEST_SIZE: Final[int] = 16
+
+
+class IndexEntry(NamedTuple):
+    """State of a single page as of the build that last wrote it."""
+    mtime_ns: int
+    size: int
+    dest_mtime_ns: int
+    digest: str
+
+
+# Recorded for a page that failed to build. Matches no source or output, so
+# the page is rebuilt on the next run, even if neither has changed since.
+FAILED_ENTRY: Final[IndexEntry] = IndexEntry(-1, -1, -1, "")
+
+
+def new_digest() -> hashlib.blake2b:
+    return hashlib.blake2b(digest_size=DIGEST_SIZE)
+
+
+def hash_file(path: Path) -> str:
+    """
+    Return a hash of the contents of a file.
+    :raise OSError: If the file cannot be read.
+    """
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, new_digest).hexdigest()
+
+
+def stat_templates(template_dir: Path) -> list[list[str | int]]:
+    """
+    Return the relative path, size and mtime of every file in the template
+    directory. Cheap to compare, so the templates are only hashed again
+    when this changes.
+    """
+    stats = []
+    stack = [(str(template_dir), "")]
+
+    while stack:
+        path, prefix = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    # DirEntry caches its stat result, so each file is
+                    # stat'ed once, by the walk itself.
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append((entry.path, f"{prefix}{entry.name}/"))
+                    elif entry.is_file():
+                        st = entry.stat()
+                        stats.append([prefix + entry.name, st.st_size, st.st_mtime_ns])
+
+        except OSError:
+            # Skipped, as rglob() did. There is nothing to load from it.
+            continue
+
+    return sorted(stats)
+
+
+def hash_templates(template_dir: Path) -> str:
+    """
+    Return a hash of every file in the template directory.
+    Used to detect template changes between builds.
+    """
+    digest = new_digest()
+    if not template_dir.is_dir():
+        return digest.hexdigest()
+
+    for file in sorted(p for p in template_dir.rglob("*") if p.is_file()):
+        digest.update(file.relative_to(template_dir).as_posix().encode())
+        digest.update(file.read_bytes())
+
+    return digest.hexdigest()
+
+
+def bytecode_cache(root: Path) -> Optional[FileSystemBytecodeCache]:
+    """
+    Return a Jinja2 bytecode cache stored under the cache directory of the
+    site, so compiled templates are reused across worker processes and runs.
+    :return: The bytecode cache, or None if the directory cannot be created.
+    """
+    directory = root.joinpath(CACHE_DIR, BYTECODE_DIR)
+
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+    except OSError as e:
+        logger.debug("Template bytecode cache disabled: %s", e)
+        return None
+
+    return FileSystemBytecodeCache(str(directory))
+
+
+class IndexCache:
+    """
+    Persistent index of the source tree, stored between builds.
+
+    Records the source mtime, size and content hash of each page, along with
+    the mtime of its destination file when it was last built, keyed by the
+    source path relative to the source directory. A hash of the template
+    directory is stored alongside, so template changes invalidate every page.
+
+    :ivar path: Location of the index file.
+    :ivar template_hash: Hash of the template directory for this build.
+    :ivar template_stats: Path, size and mtime of each template file.
+    :ivar templates_changed: Templates differ from those of the last build.
+    :ivar entries: Index entries as loaded from disk, or updated this build.
+    """
+    path: Final[Path]
+    template_hash: Final[str]
+    template_stats: Final[list[list[str | int]]]
+    templates_changed: Final[bool]
+    entries: dict[str, IndexEntry]
+
+    def __init__(self, root: Path, template_dir: Path):
+        self.path = root.joinpath(CACHE_DIR, INDEX_FILE)
+        self.entries = {}
+        self.template_stats = stat_templates(template_dir)
+
+        cached_hash, cached_stats = self.load()
+        if cached_hash is not None and cached_stats == self.template_stats:
+            # No template was touched, so the contents cannot differ.
+            self.template_hash = cached_hash
+        else:
+            self.template_hash = hash_templates(template_dir)
+
+        self.templates_changed = (
+            cached_hash is not None
+            and cached_hash != self.template_hash
+        )
+
+        if self.templates_changed:
+            logger.debug("Templates changed since last build.")
+
+    def load(self) -> tuple[Optional[str], Optional[list[list[str | int]]]]:
+        """
+        Load the index from disk.
+        :return: The template hash and template stats stored with the
+            index, both None if there is no usable index.
+        """
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None, None
+
+        if not isinstance(data, dict) or data.get("version") != CACHE_VERSION:
+            logger.debug("Ignoring outdated index cache %s", self.path)
+            return None, None
+
+        self.entries = {
+            key: IndexEntry(*value)
+            for key, value in data.get("entries", {}).items()
+        }
+        return data.get("templates"), data.get("template_stats")
+
+    def save(self) -> None:
+        """
+        Write the index to disk.
+        :raise IOError: If the index cannot be written for any reason.
+        """
+        data = {
+            "version": CACHE_VERSION,
+            "templates": self.template_hash,
+            "template_stats": self.template_stats,
+            "entries": self.entries,
+        }
+
+        # Renamed over the index once written, so a crash mid-write leaves
+        # the previous index rather than a truncated one.
+        temp = self.path.with_name(self.path.name + ".tmp")
+
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # dumps() uses the C encoder, dump() to a file does not.
+            temp.write_text(json.dumps(data), encoding="utf-8")
+            os.replace(temp, self.path)
+
+        except OSError as e:
+            temp.unlink(missing_ok=True)
+            raise IOError(*e.args) from e
+
+    def get(self, key: str) -> Optional[IndexEntry]:
+        return self.entries.get(key)
+
+    def update(self, context: BuildContext) -> None:
+        """
+        Record the current state of a page. If the destination file does not
+        exist, or the source cannot be read, the page is removed from the
+        index instead.
+        """
+        try:
+            dest_stat = context.dest_path.stat()
+            digest = context.source_digest
+        except OSError:
+            self.entries.pop(context.cache_key, None)
+            return
+
+        self.entries[context.cache_key] = IndexEntry(
+            context.source_stat.st_mtime_ns,
+            context.source_stat.st_size,
+            dest_stat.st_mtime_ns,
+            digest
+        )
+
+    def discard(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+    def mark_failed(self, key: str) -> None:
+        """
+        Record that a page failed to build, so it is retried next build.
+        Dropping the entry instead would leave the page to be judged by
+        mtimes alone, which an old output can pass.
+        """
+        self.entries[key] = FAILED_ENTRY
+
+    def prune(self, keys: set[str], keep_under: Iterable[Path] = ()) -> set[str]:
+        """
+        Drop entries for pages not in ``keys``, i.e. deleted sources.
+        :param keep_under: Directories, relative to the source directory,
+            whose entries are kept regardless. Such as those that could not
+            be read, so whether their pages still exist is unknown.
+        :return: The keys dropped.
+        """
+        # Path(".").parts is empty; that is the source directory itself.
+        prefixes = tuple(
+            (d.as_posix() + "/") if d.parts else "" for d in keep_under
+        )
+        removed = {
+            key for key in self.entries.keys() - keys
+            if not key.startswith(prefixes)
+        }
+        for key in removed:
+            del self.entries[key]
+        return removed
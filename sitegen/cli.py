@@ -1,22 +1,51 @@
 import time
-from typing import Self
+from typing import Final, Self
 from .context import BuildReason
 
+STAT_NAMES: Final[tuple[str, ...]] = (
+    "Created", "Draft", "Changed", "Unchanged", "Deleted", "Errors"
+)
+STAT_WIDTH: Final[int] = max(len(name) for name in STAT_NAMES)
+
 class BuildStats:
     """
     Class for storing build statistics.
+
+    Counts for each ``BuildReason`` are kept in ``counts``, indexed by the
+    reason's value.
     """
-    created: int = 0
-    changed: int = 0
-    unchanged: int = 0
-    deleted: int = 0
-    errors: int = 0
-    draft: int = 0
-    validated: int = 0
+    counts: list[int]
+    errors: int
+    draft: int
     start_time: float
     end_time: float
     total_time_s: float
 
+    def __init__(self):
+        self.counts = [0] * len(BuildReason)
+        self.errors = 0
+        self.draft = 0
+
+    @property
+    def created(self) -> int:
+        return self.counts[BuildReason.CREATED]
+
+    @property
+    def changed(self) -> int:
+        return self.counts[BuildReason.CHANGED]
+
+    @property
+    def unchanged(self) -> int:
+        return self.counts[BuildReason.UNCHANGED]
+
+    @property
+    def deleted(self) -> int:
+        return self.counts[BuildReason.DELETED]
+
+    @property
+    def validated(self) -> int:
+        return self.counts[BuildReason.VALIDATION]
+
     def __enter__(self) -> Self:
         self.start_time = time.perf_counter()
         return self
@@ -27,11 +56,8 @@ class BuildStats:
 
 
     def summary(self) -> str:
-        total_pages = sum({
-            self.created, self.changed,
-             self.unchanged, self.deleted,
-            self.validated, self.errors,
-        })
+        # Every reason, validated included, plus drafts and pages that failed.
+        total_pages = sum(self.counts) + self.draft + self.errors
 
         if total_pages == 0:
             return "Nothing to do."
@@ -45,33 +71,18 @@ class BuildStats:
             status,
             f"Processed {total_pages} pages in {self.total_time_s:.2f}s.",
         ]
-        stats = [
-            ("Created", self.created),
-            ("Draft", self.draft),
-            ("Changed", self.changed),
-            ("Unchanged", self.unchanged),
-            ("Deleted", self.deleted),
-            ("Errors", self.errors),
-        ]
+        values = (
+            self.created, self.draft, self.changed,
+            self.unchanged, self.deleted, self.errors,
+        )
 
-        width = max(len(name) for name, _ in stats)
-        for name, value in stats:
+        for name, value in zip(STAT_NAMES, values):
             if value:
-                lines.append(f"  {name.ljust(width)} {value}")
+                lines.append(f"  {name.ljust(STAT_WIDTH)} {value}")
         return "\n".join(lines)
 
     def add_stat(self, build_reason: BuildReason | int):
-        if isinstance(build_reason, int):
+        if not isinstance(build_reason, BuildReason):
             build_reason = BuildReason(build_reason)
 
-        match build_reason:
-            case BuildReason.CHANGED:
-                self.changed += 1
-            case BuildReason.UNCHANGED:
-                self.unchanged += 1
-            case BuildReason.CREATED:
-                self.created += 1
-            case BuildReason.DELETED:
-                self.deleted += 1
-            case BuildReason.VALIDATION:
-                self.validated += 1
\ No newline at end of file
+        self.counts[build_reason] += 1
@@ -1,12 +1,14 @@
 from __future__ import annotations
+import os
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import IntEnum, Enum
 from pathlib import Path
 from typing import Final, Optional, Any, Mapping
-from urllib.parse import urljoin, quote
+from urllib.parse import quote
 from jinja2 import Environment
 from markupsafe import Markup
+from .cache import IndexEntry, hash_file
 
 
 class BuildReason(IntEnum):
@@ -17,6 +19,13 @@ class BuildReason(IntEnum):
     VALIDATION = 4
 
 
+MODIFIED_REASONS: Final[frozenset[BuildReason]] = frozenset({
+    BuildReason.CREATED,
+    BuildReason.CHANGED,
+    BuildReason.VALIDATION
+})
+
+
 class FileType(Enum):
     """Represents file types supported by generator."""
     OTHER = frozenset() #For invalid file types
@@ -42,22 +51,28 @@ class FileType(Enum):
 
     @classmethod
     def from_suffix(cls, suffix: str) -> FileType:
-        for f_st in cls:
-            if suffix.lower() in f_st.value:
-                return f_st
-        return cls.OTHER
+        return _SUFFIX_TYPES.get(suffix.lower(), cls.OTHER)
 
     @classmethod
-    def all(cls) -> frozenset[FileType]:
-        return frozenset().union(*(f_st.value for f_st in cls))
+    def all(cls) -> frozenset[str]:
+        """Return every suffix of a supported file type."""
+        return _ALL_SUFFIXES
+
 
+# Built once at import, as the members and their suffixes never change.
+_SUFFIX_TYPES: Final[dict[str, FileType]] = {
+    suffix: f_st for f_st in FileType for suffix in f_st.value
+}
+_ALL_SUFFIXES: Final[frozenset[str]] = frozenset(_SUFFIX_TYPES)
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class TemplateContext:
     html: Markup
     table_of_contents: Markup
     title: Markup
     modified: datetime
+    modified_str: str
     url: str
     yml: Mapping[Any, Any]
     now: datetime
@@ -68,64 +83,199 @@ class BuildContext:
     Class representing context for use during a page build.
 
     :ivar source_path: Absolute path to the source file.
+    :ivar source_name: File name of the source file.
     :ivar source_path_lastmod: The last modified date of the source file.
+    :ivar source_stat: Stat result of the source file, as cached by ``os.scandir``.
+    :ivar source_mtime_ns: The mtime of the source file in nanoseconds.
     :ivar dest_path: Absolute path to the destination file.
     :ivar dest_path_lastmod: The last modified date of the destination file if exists.
+    :ivar dest_mtime_ns: The mtime of the destination file in nanoseconds, 0 if absent.
+    :ivar dest_exists: The destination file existed when indexed.
     :ivar template_path: Absolute path to the template directory.
     :ivar type: FileType representing the file type.
     :ivar url_path: Absolute URL path of output file.
     :ivar validate_only: Do not write build to output file.
+    :ivar cache_key: Source path relative to the source directory, as stored in the index cache.
+    :ivar index_entry: State of this page as of the last build, if known.
+    :ivar templates_changed: Templates changed since the last build.
     """
+    # One is kept for every file in the tree, so avoid a __dict__ for each.
+    __slots__ = (
+        "source_path", "source_name", "source_stat", "source_mtime_ns",
+        "dest_path", "dest_mtime_ns", "dest_exists", "template_path",
+        "jinja_env", "type", "url_path", "validate_only", "cache_key",
+        "index_entry", "templates_changed",
+        "_source_path_lastmod", "_dest_path_lastmod", "_source_digest",
+        "_build_reason",
+    )
+
     source_path: Final[Path]
-    source_path_lastmod: Final[datetime]
+    source_name: Final[str]
+    source_stat: Final[os.stat_result]
+    source_mtime_ns: Final[int]
     dest_path: Final[Path]
-    dest_path_lastmod: Final[Optional[datetime]]
+    dest_mtime_ns: Final[int]
+    dest_exists: Final[bool]
     template_path: Final[Path]
     jinja_env: Final[Environment]
     type: Final[FileType]
     url_path: Final[str]
     validate_only: bool
+    cache_key: Final[str]
+    index_entry: Final[Optional[IndexEntry]]
+    templates_changed: Final[bool]
+    _source_path_lastmod: Optional[datetime]
+    _dest_path_lastmod: Optional[datetime]
+    _source_digest: Optional[str]
+    _build_reason: Optional[BuildReason]
 
-    def __init__(self, site: "SiteRoot", source: Path, dest: Path, env: Environment): #type: ignore
+    def __init__(
+            self,
+            site: "SiteRoot", #type: ignore
+            source: Path,
+            dest: Path,
+            env: Environment,
+            source_stat: Optional[os.stat_result] = None
+    ):
         self.source_path = site.source_dir.joinpath(source)
+        self.source_name = os.path.basename(source)
         self.dest_path = site.dest_dir.joinpath(dest)
         self.template_path = site.template_dir
         self.type = FileType.from_suffix(self.source_path.suffix)
         self.jinja_env = env
         self.validate_only = False
+        self.cache_key = source.as_posix()
+        self.index_entry = site.index_cache.get(self.cache_key)
+        self.templates_changed = site.index_cache.templates_changed
+        self._source_path_lastmod = None
+        self._dest_path_lastmod = None
+        self._source_digest = None
+        self._build_reason = None
 
         url = dest.as_posix()
         if url.endswith(f"/{site.url_index}") or url == site.url_index:
             url = url.removesuffix(site.url_index)
 
-        self.url_path = urljoin(site.url_base, quote(url))
+        # Paths are relative and quoted, so joining is just concatenation.
+        self.url_path = (site.url_prefix + quote(url)) if url else site.url_base
 
-        self.source_path_lastmod = datetime.fromtimestamp(
-            self.source_path.stat().st_mtime,
-            tz=timezone.utc
+        self.source_stat = (
+            source_stat
+            if source_stat is not None
+            else self.source_path.stat()
         )
 
-        self.dest_path_lastmod = datetime.fromtimestamp(
-            self.dest_path.stat().st_mtime
-            if self.dest_path.exists()
-            else 0,
-            tz=timezone.utc,
-        )
+        self.source_mtime_ns = self.source_stat.st_mtime_ns
+
+        dest_mtime_ns: Optional[int]
+        dest_key = dest.as_posix()
+        if (
+            site.dest_index is not None
+            and not dest_key.startswith(site.dest_unindexed)
+        ):
+            dest_mtime_ns = site.dest_index.get(dest_key)
+        else:
+            # Not indexed, or under a directory the index could not read.
+            try:
+                dest_mtime_ns = self.dest_path.stat().st_mtime_ns
+            except OSError:
+                dest_mtime_ns = None
+
+        self.dest_exists = dest_mtime_ns is not None
+        self.dest_mtime_ns = dest_mtime_ns or 0
+
+    def __getstate__(self) -> dict[str, Any]:
+        # The environment is shared, workers are given it once by build_all()
+        state = {name: getattr(self, name) for name in self.__slots__}
+        state["jinja_env"] = None
+        return state
+
+    def __setstate__(self, state: dict[str, Any]) -> None:
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    # Only needed by templates and sorting, not to decide what is built,
+    # so created on first access rather than for every page.
+    @property
+    def source_path_lastmod(self) -> datetime:
+        if self._source_path_lastmod is None:
+            self._source_path_lastmod = datetime.fromtimestamp(
+                self.source_stat.st_mtime, tz=timezone.utc
+            )
+        return self._source_path_lastmod
+
+    @property
+    def dest_path_lastmod(self) -> datetime:
+        if self._dest_path_lastmod is None:
+            self._dest_path_lastmod = datetime.fromtimestamp(
+                self.dest_mtime_ns / 1e9, tz=timezone.utc
+            )
+        return self._dest_path_lastmod
 
     @property
     def build_reason(self) -> BuildReason:
         if self.validate_only:
             return BuildReason.VALIDATION
 
-        if not self.dest_path.exists():
+        # Read by the build, sorting and is_modified; derived from values
+        # fixed at construction, so found once.
+        if self._build_reason is None:
+            self._build_reason = self._find_build_reason()
+        return self._build_reason
+
+    def _find_build_reason(self) -> BuildReason:
+        if not self.dest_exists:
             return BuildReason.CREATED
 
-        if self.source_path_lastmod > self.dest_path_lastmod:
+        if self.templates_changed:
+            return BuildReason.CHANGED
+
+        if self.index_entry is not None:
+            return (
+                BuildReason.UNCHANGED
+                if self.matches_index()
+                else BuildReason.CHANGED
+            )
+
+        if self.source_mtime_ns > self.dest_mtime_ns:
             return BuildReason.CHANGED
 
         return BuildReason.UNCHANGED
 
+    @property
+    def source_digest(self) -> str:
+        """
+        Hash of the source file contents. Read on first access only.
+        :raise OSError: If the source file cannot be read.
+        """
+        if self._source_digest is None:
+            self._source_digest = hash_file(self.source_path)
+        return self._source_digest
+
+    def matches_index(self) -> bool:
+        """
+        Check the source and destination are as recorded by the index cache.
+        The source is hashed only if its mtime differs from the index, so
+        touched, but unedited, files are not rebuilt.
+        """
+        entry = self.index_entry
+        if entry is None:
+            return False
+
+        if (
+            entry.dest_mtime_ns != self.dest_mtime_ns
+            or entry.size != self.source_stat.st_size
+        ):
+            return False
+
+        if entry.mtime_ns == self.source_mtime_ns:
+            return True
+
+        try:
+            return entry.digest == self.source_digest
+        except OSError:
+            return False
+
     @property
     def is_modified(self) -> bool:
-        reasons = {BuildReason.CREATED, BuildReason.CHANGED, BuildReason.VALIDATION}
-        return self.build_reason in reasons
+        return self.build_reason in MODIFIED_REASONS
@@ -8,17 +8,23 @@ class LogColors(Enum):
     ERROR = '\033[31m'
     RESET = '\033[0m'
 
+WARNING_PREFIX = f"{LogColors.WARNING.value}Warn: "
+ERROR_PREFIX = f"{LogColors.ERROR.value}Error: "
+RESET = LogColors.RESET.value
+
 class LogFormatter(logging.Formatter):
     def format(self, record: logging.LogRecord):
         message = record.getMessage()
-        warn_format = f"{LogColors.WARNING.value}Warn: {message}{LogColors.RESET.value}"
-        error_format = f"{LogColors.ERROR.value}Error: {message}{LogColors.RESET.value}"
 
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+
+        # Most records are info, so check the level before formatting.
         if record.levelno == logging.WARNING:
-            return warn_format
+            return f"{WARNING_PREFIX}{message}{RESET}"
 
         elif record.levelno == logging.ERROR:
-            return error_format
+            return f"{ERROR_PREFIX}{message}{RESET}"
 
         return message
 
@@ -1,15 +1,22 @@
 from __future__ import annotations
+import heapq
 import logging
 import os
 from datetime import datetime, timezone
 from enum import Enum
+from operator import attrgetter
 from pathlib import Path
 from typing import Final, List, Union, TypeAlias, Any
-from collections.abc import Generator, Callable
+from collections.abc import Generator, Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from jinja2 import Environment, FileSystemLoader
-from .context import BuildContext, FileType
+from jinja2.environment import TemplateStream
+from .cache import IndexCache, bytecode_cache
+from .context import BuildContext, FileType, TemplateContext
 from .templates import RSS_FALLBACK, SITEMAP_FALLBACK
-from .build import Page, DEFAULT_EXTENSIONS
+from .build import (
+    Page, DEFAULT_EXTENSIONS, BUILD_ERRORS, TEMP_SUFFIX, WRITE_BUFFER_SIZE, get_template
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,59 +25,171 @@ DEST_DIR: Final[Path] = Path("build")
 TEMPLATE_DIR: Final[Path] = Path("templates")
 URL_BASE: Final[str] = "https://itsdanjc.com"
 URL_INDEX: Final[str] = "index.html"
+INDEX_WORKERS: Final[int] = 8
+RSS_LIMIT: Final[int] = 20
+AUTOESCAPE_EXTENSIONS: Final[tuple[str, ...]] = ("html", "htm", "xml")
+AUTOESCAPE_SUFFIXES: Final[tuple[str, ...]] = tuple(
+    f".{ext}" for ext in AUTOESCAPE_EXTENSIONS
+)
 
 TreeItem: TypeAlias = Union["TreeNode", BuildContext]
 
 
+def autoescape(template_name: str | None) -> bool:
+    """
+    Return whether a template outputs markup, so should be autoescaped.
+    Templates from strings are not.
+
+    Used in place of ``select_autoescape()``, which returns a closure.
+    A module-level function keeps the environment picklable, so it can be
+    sent to worker processes when they are spawned rather than forked.
+    """
+    if template_name is None:
+        return False
+    return template_name.lower().endswith(AUTOESCAPE_SUFFIXES)
+
+
+def write_stream(path: Path, chunks: Iterable[str]) -> None:
+    """
+    Write ``chunks``, such as a :class:`jinja2.TemplateStream`, to ``path``
+    as UTF-8 as they are produced, so the whole output is never held in
+    memory at once. The file is replaced only once fully written.
+    The parent directory must already exist.
+    :raise IOError: If the file cannot be written for any reason.
+    """
+    temp = path.with_name(path.name + TEMP_SUFFIX)
+
+    try:
+        # Opened as pages are, so all output has the same line endings.
+        with temp.open(
+            "w", errors="ignore", encoding="utf-8", buffering=WRITE_BUFFER_SIZE
+        ) as f:
+            f.writelines(chunks)
+        os.replace(temp, path)
+
+    except BaseException:
+        temp.unlink(missing_ok=True)
+        raise
+
+
 class SortKey(Enum):
     """Sort key methods. For TreeNode.sort()"""
-    BUILD_REASON = lambda page: page.build_reason
-    FILE_TYPE = lambda page: page.type
-    PATH = lambda page: page.url_path
-    LAST_MODIFIED = lambda page: page.source_path_lastmod
-    LAST_BUILD_DATE = lambda page: page.dest_path_lastmod
+    BUILD_REASON = attrgetter("build_reason")
+    FILE_TYPE = attrgetter("type")
+    PATH = attrgetter("url_path")
+    # Same order as the lastmod datetimes, without creating one per page.
+    LAST_MODIFIED = attrgetter("source_mtime_ns")
+    LAST_BUILD_DATE = attrgetter("dest_mtime_ns")
 
 
 class TreeNode:
+    """
+    A directory of the source tree, holding its pages and subdirectories.
+
+    Once the tree is complete, ``finalize()`` stores the pages of each
+    subtree in a flat list, so iterating, counting and membership tests
+    no longer recurse. ``TreeBuilder`` does this when it is done; call it
+    again after changing ``pages`` or ``sub_dirs`` by hand.
+    """
+    __slots__ = (
+        "path", "parent", "pages", "sub_dirs",
+        "_pages_flat", "_pages_set", "_path_index",
+    )
+
     path: Final[Path]
     parent: Final[TreeNode | None]
     pages: list[BuildContext]
     sub_dirs: list[TreeNode]
+    _pages_flat: list[BuildContext] | None
+    _pages_set: frozenset[BuildContext] | None
+    _path_index: dict[Path, TreeItem] | None
 
     def __init__(self, path: Path, parent: TreeNode | None = None):
         self.path = path
         self.parent = parent
         self.pages = []
         self.sub_dirs = []
+        self._pages_flat = None
+        self._pages_set = None
+        self._path_index = None
+
+    def __iter__(self) -> Iterator[BuildContext]:
+        if self._pages_flat is not None:
+            return iter(self._pages_flat)
+        return self._iter_pages()
+
+    def _iter_pages(self) -> Generator[BuildContext, None, None]:
+        # Depth first with an explicit stack rather than nested generators,
+        # so each page passes through one frame whatever the depth.
+        # Subdirectories are pushed reversed, to pop in the order listed.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node._pages_flat is not None:
+                yield from node._pages_flat
+                continue
 
-    def __iter__(self) -> Generator[BuildContext, None, None]:
-        yield from self.pages
-        for s_d in self.sub_dirs:
-            yield from s_d
+            yield from node.pages
+            stack.extend(reversed(node.sub_dirs))
 
     def __len__(self) -> int:
+        if self._pages_flat is not None:
+            return len(self._pages_flat)
         return sum(1 for _ in self)
 
     def __contains__(self, item: TreeItem) -> bool:
         if isinstance(item, BuildContext):
-            return any(i for i in self)
+            if self._pages_flat is None:
+                return any(i is item for i in self)
+            if self._pages_set is None:
+                self._pages_set = frozenset(self._pages_flat)
+            return item in self._pages_set
 
         if isinstance(item, TreeNode):
-            return any(i for i in self.walk())
+            return any(i is item for i in self.walk())
 
         return False
 
+    def _index_paths(self) -> dict[Path, TreeItem]:
+        # Pages take precedence over directories of the same path, as when
+        # searched in order.
+        index: dict[Path, TreeItem] = {s_d.path: s_d for s_d in self.walk()}
+        index.update((page.source_path, page) for page in self)
+        return index
+
+    def finalize(self) -> list[BuildContext]:
+        """
+        Store the pages of this node and every subdirectory in a flat list,
+        in the order iteration would yield them.
+        :return: The flat list of pages.
+        """
+        pages_flat = list(self.pages)
+        for s_d in self.sub_dirs:
+            pages_flat.extend(s_d.finalize())
+
+        self._pages_flat = pages_flat
+        self._pages_set = None
+        self._path_index = None
+        return pages_flat
+
     def __getitem__(self, path: Path) -> TreeItem:
         if self.path == path:
             return self
 
-        for page in self:
-            if page.source_path == path:
-                return page
-
-        for s_d in self.walk():
-            if s_d.path == path:
-                return s_d
+        if self._pages_flat is not None:
+            if self._path_index is None:
+                self._path_index = self._index_paths()
+            item = self._path_index.get(path)
+            if item is not None:
+                return item
+        else:
+            for page in self:
+                if page.source_path == path:
+                    return page
+
+            for s_d in self.walk():
+                if s_d.path == path:
+                    return s_d
 
         raise KeyError(
             f"Directory or file {path} not in {self.path} or any subdirectory"
@@ -78,12 +197,35 @@ class TreeNode:
 
     def walk(self) -> Generator[TreeNode, None, None]:
         """Return a generator of all subdirectories of self"""
-        yield from self.sub_dirs
-        for s_d in self.sub_dirs:
-            yield from s_d.walk()
+        # Same order as yielding the subdirectories of each node, then
+        # walking each in turn, without a generator per level.
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield from node.sub_dirs
+            stack.extend(reversed(node.sub_dirs))
+
+    def sort(
+            self,
+            key: SortKey | Callable[[BuildContext], Any],
+            reverse: bool | None = True,
+            limit: int | None = None
+    ) -> List[BuildContext]:
+        """
+        Return a sorted copy of self.
+
+        :param key: A ``SortKey``, or any callable taking a ``BuildContext``.
+        :param reverse: Sort in descending order.
+        :param limit: Only return the first ``limit`` pages. Uses a heap,
+            so avoids sorting the whole tree when only a few are needed.
+        """
+        if isinstance(key, SortKey):
+            key = key.value
+
+        if limit is not None:
+            select = (heapq.nlargest if reverse else heapq.nsmallest)
+            return select(limit, self, key=key)
 
-    def sort(self, key: Callable[[BuildContext], Any], reverse: bool | None = True) -> List[BuildContext]:
-        """Return a sorted copy of self."""
         return sorted(
             self,
             key=key,
@@ -92,57 +234,136 @@ class TreeNode:
 
 
 class TreeBuilder:
+    """
+    Index the source directory of a site into ``site.tree``.
+
+    Directories are scanned concurrently on a thread pool; ``os.scandir``
+    releases the GIL while listing, so scans of sibling directories overlap.
+    Each task fills in exactly one ``TreeNode``, so no locking is needed.
+
+    :ivar failed_dirs: Directories that could not be read, relative to the
+        source directory. Their pages are missing from the tree, but are
+        not necessarily deleted.
+    """
     site: Final[SiteRoot]
+    failed_dirs: Final[List[Path]]
     valid_ext: Final[frozenset[str]] = FileType.all()
-    node: TreeNode
-    node_path: Path
-    node_dir_list: List[str]
-    node_file_list: List[str]
-    node_not_root: bool
+    max_workers: Final[int] = INDEX_WORKERS
 
     def __init__(self, site: SiteRoot):
         self.site = site
-        self.node = site.tree
-
-        for curr_dir, dir_list, file_list in os.walk(self.site.source_dir):
-            self.node_path = Path(curr_dir)
-            self.node_dir_list = dir_list
-            self.node_file_list = file_list
-
-            self.node_not_root = (curr_dir != self.site.tree.path)
-
-            if self.node_not_root:
-                self.node = self.site.tree[self.node_path]
-
-            self.create_directory_nodes()
-            self.create_file_nodes()
-
-    def create_directory_nodes(self):
-        for sub_dir in self.node_dir_list:
-            node_path = Path(self.node_path, sub_dir)
-            self.node.sub_dirs.append(
-                TreeNode(node_path, parent=self.node)
+        self.failed_dirs = []
+        site.dest_index, site.dest_unindexed = self.index_dest(site.dest_dir)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self.build_node, site.tree)}
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for sub_dir in future.result():
+                        pending.add(executor.submit(self.build_node, sub_dir))
+
+        site.tree.finalize()
+
+    def build_node(self, node: TreeNode) -> List[TreeNode]:
+        """
+        Populate a single node from its directory.
+        :return: The subdirectory nodes still to be built.
+        """
+        try:
+            dir_list, file_list = self.scan_directory(node.path)
+        except OSError as e:
+            logger.warning("Cannot read directory %s: %s", node.path, e.strerror)
+            # list.append() is atomic, so this too needs no lock.
+            self.failed_dirs.append(node.path.relative_to(self.site.source_dir))
+            return []
+
+        self.create_directory_nodes(node, dir_list)
+        self.create_file_nodes(node, file_list)
+        return node.sub_dirs
+
+    @staticmethod
+    def index_dest(dest_dir: Path) -> tuple[dict[str, int], tuple[str, ...]]:
+        """
+        Walk the destination directory once, mapping the POSIX path of each
+        built page, relative to ``dest_dir``, to its mtime in nanoseconds.
+        Lets each ``BuildContext`` look up its destination instead of
+        issuing its own ``stat()`` calls.
+        :return: The index, and the path prefixes of directories that could
+            not be read. Pages under those are missing from the index.
+        """
+        dest_index = {}
+        unindexed = []
+        stack = [(str(dest_dir), "")]
+
+        while stack:
+            path, prefix = stack.pop()
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append((entry.path, f"{prefix}{entry.name}/"))
+                        elif entry.name.endswith(".html"):
+                            dest_index[prefix + entry.name] = entry.stat().st_mtime_ns
+
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.warning("Cannot read directory %s: %s", path, e.strerror)
+                unindexed.append(prefix)
+
+        return dest_index, tuple(unindexed)
+
+    @staticmethod
+    def scan_directory(path: Path) -> tuple[List[os.DirEntry], List[os.DirEntry]]:
+        """
+        List a directory with a single ``os.scandir`` call, splitting entries
+        into directories and files. ``DirEntry`` caches the file type and
+        stat result, so no further syscalls are needed to classify entries.
+        :raise OSError: If the directory cannot be read.
+        """
+        dir_list = []
+        file_list = []
+
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    dir_list.append(entry)
+                elif entry.is_file(follow_symlinks=False):
+                    file_list.append(entry)
+
+        return dir_list, file_list
+
+    @staticmethod
+    def create_directory_nodes(node: TreeNode, dir_list: List[os.DirEntry]):
+        for entry in dir_list:
+            node_path = Path(node.path, entry.name)
+            node.sub_dirs.append(
+                TreeNode(node_path, parent=node)
             )
 
-    def create_file_nodes(self):
-        for file in self.node_file_list:
-            file_path = Path(self.node_path, file).relative_to(
+    def create_file_nodes(self, node: TreeNode, file_list: List[os.DirEntry]):
+        for entry in file_list:
+            # Filter on the name first, most files in a tree are not pages.
+            if not (os.path.splitext(entry.name)[1].lower() in self.valid_ext):
+                continue
+
+            file_path = Path(node.path, entry.name).relative_to(
                 self.site.source_dir
             )
 
             dest = file_path.with_suffix(".html")
 
-            if not (file_path.suffix.lower() in self.valid_ext):
-                continue
-
             context = BuildContext(
                 site=self.site,
                 source=file_path,
                 dest=dest,
-                env=self.site.env
+                env=self.site.env,
+                source_stat=entry.stat()
             )
 
-            self.node.pages.append(context)
+            node.pages.append(context)
 
 
 class SiteRoot:
@@ -155,7 +376,13 @@ class SiteRoot:
     dest_dir: Final[Path]
     template_dir: Final[Path]
     env: Final[Environment]
+    build_time: Final[datetime]
+    index_cache: Final[IndexCache]
+    dest_index: dict[str, int] | None
+    dest_unindexed: tuple[str, ...]
+    _template_contexts: dict[BuildContext, TemplateContext | None]
     url_base: Final[str] = URL_BASE
+    url_prefix: Final[str]
     url_index: Final[str] = URL_INDEX
 
     def __init__(self, path: Path):
@@ -164,48 +391,154 @@ class SiteRoot:
         self.dest_dir = path.joinpath(DEST_DIR)
         self.template_dir = path.joinpath(TEMPLATE_DIR)
         self.tree = TreeNode(self.source_dir)
+        self.url_prefix = self.url_base.removesuffix("/") + "/"
         self.env = Environment(
-            autoescape=True,
+            # Only templates that output markup need escaping. Those for
+            # other formats, and those from strings, are left as written.
+            autoescape=autoescape,
             auto_reload=False,
-            loader=FileSystemLoader(self.template_dir)
+            loader=FileSystemLoader(self.template_dir),
+            bytecode_cache=bytecode_cache(self.root)
         )
+        # Same for every page of a build, so set once rather than per page.
+        self.build_time = datetime.now(timezone.utc)
+        self.env.globals["now"] = self.build_time
+        self.index_cache = IndexCache(self.root, self.template_dir)
+        self.dest_index = None
+        self.dest_unindexed = ()
+        self._template_contexts = {}
 
     def clean_dest(self) -> List[Path]:
+        """
+        Delete every HTML file under the destination directory, leaving
+        any other files in the webroot in place.
+        :return: The paths removed.
+        """
         total_removed = []
-        for file in self.dest_dir.glob("**"):
-            if not (file.is_file() and file.suffix.lower() in FileType.HTML.value):
+        html_ext = FileType.HTML.value
+        stack = [str(self.dest_dir)]
+
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
                 continue
 
-            logger.debug("Cleanup deleted %s", file)
-            file.unlink(missing_ok=True)
-            total_removed.append(file)
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+
+                    if not (os.path.splitext(entry.name)[1].lower() in html_ext):
+                        continue
+
+                    try:
+                        os.unlink(entry.path)
+                    except FileNotFoundError:
+                        continue
+
+                    logger.debug("Cleanup deleted %s", entry.path)
+                    total_removed.append(Path(entry.path))
 
         return total_removed
 
-    def make_rss(self) -> str:
-        rss_template = self.env.get_or_select_template(
-            ["feed.xml", RSS_FALLBACK]
-        )
+    def delete_outputs(self, cache_keys: Iterable[str]) -> List[Path]:
+        """
+        Delete the built pages of sources that no longer exist, as found
+        from the index cache, without walking the destination directory.
+        Pages still built from another source are left in place.
+        :param cache_keys: Index cache keys of the deleted sources.
+        :return: The paths removed.
+        """
+        live = {context.dest_path for context in self.tree}
+        total_removed = []
 
-        tree = []
-        now: datetime = datetime.now(timezone.utc)
-        for context in self.tree.sort(SortKey.LAST_MODIFIED):
-            page = Page(context, DEFAULT_EXTENSIONS)
-            page.parse()
-            tree.append(page.get_template_context())
+        for key in cache_keys:
+            dest = self.dest_dir.joinpath(key).with_suffix(".html")
+            if dest in live or not self.delete_output(dest):
+                continue
 
-        return rss_template.render(site=self, tree=tree, now=now)
+            logger.debug("Deleted %s, source removed", dest)
+            total_removed.append(dest)
 
-    def make_sitemap(self) -> str:
-        sitemap_template = self.env.get_or_select_template(
-            ["sitemap.xml", SITEMAP_FALLBACK]
-        )
+        return total_removed
 
+    @staticmethod
+    def delete_output(dest: Path) -> bool:
+        """
+        Delete a single built page, if it exists.
+        :return: True if the file was removed.
+        """
+        try:
+            dest.unlink()
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning("Cannot delete %s: %s", dest, e.strerror)
+            return False
+        return True
+
+    def template_contexts(self, limit: int | None = None) -> List[TemplateContext]:
+        """
+        Return the template context of each page, newest first, leaving
+        out drafts and pages that cannot be read. Each page is rendered at
+        most once, the results are shared by the feed and sitemap.
+        :param limit: Return at most this many pages. Pages past the limit
+            are not rendered.
+        """
         tree = []
-        now: datetime = datetime.now(timezone.utc)
         for context in self.tree.sort(SortKey.LAST_MODIFIED):
-            page = Page(context, DEFAULT_EXTENSIONS)
-            page.parse()
-            tree.append(page.get_template_context())
-
-        return sitemap_template.render(site=self, tree=tree, now=now)
\ No newline at end of file
+            if limit is not None and len(tree) >= limit:
+                break
+
+            if context in self._template_contexts:
+                template_context = self._template_contexts[context]
+            else:
+                template_context = self.make_template_context(context)
+                self._template_contexts[context] = template_context
+
+            if template_context is not None:
+                tree.append(template_context)
+
+        return tree
+
+    @staticmethod
+    def make_template_context(context: BuildContext) -> TemplateContext | None:
+        """
+        Read and render a single page.
+        :return: The template context, or None for drafts, and pages that
+            cannot be read.
+        """
+        page = Page(context, DEFAULT_EXTENSIONS)
+        try:
+            yml, body = page.read()
+        except BUILD_ERRORS:
+            return None # Already reported when building the page.
+
+        if page.metadata.get("is_draft", False):
+            return None
+
+        page.parse(body=body)
+        return page.get_template_context()
+
+    def make_rss(self, limit: int | None = RSS_LIMIT) -> TemplateStream:
+        """
+        Render the feed of the newest pages.
+        :param limit: Number of pages in the feed, None for every page.
+        :return: The feed, rendered lazily as it is iterated.
+        """
+        rss_template = get_template(self.env, "feed.xml", RSS_FALLBACK)
+
+        tree = self.template_contexts(limit)
+        return rss_template.stream(site=self, tree=tree, now=self.build_time)
+
+    def make_sitemap(self) -> TemplateStream:
+        """
+        Render the sitemap of every page.
+        :return: The sitemap, rendered lazily as it is iterated.
+        """
+        sitemap_template = get_template(self.env, "sitemap.xml", SITEMAP_FALLBACK)
+
+        tree = self.template_contexts()
+        return sitemap_template.stream(site=self, tree=tree, now=self.build_time)
\ No newline at end of file
@@ -9,7 +9,7 @@ PAGE_FALLBACK: Final[Template] = Template(
     "<body>"
         "<h1>{{page.title}}</h1>"
         "<div style=\"float:right\">{{page.table_of_contents}}</div>"
-        "<p>Last Modified: {{page.modified.strftime(\"%d %b %y\")}}</p>"
+        "<p>Last Modified: {{page.modified_str}}</p>"
         "{{page.html}}"
     "</body>"
     "</html>"
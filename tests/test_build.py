@@ -0,0 +1,164 @@
+import logging
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+from sitegen.__main__ import build as build_site
+from sitegen.build import (
+    build, build_all, decode_source, load_metadata, split_front_matter
+)
+from sitegen.context import BuildReason
+from sitegen.site import SiteRoot, TreeBuilder
+
+
+def make_site(root: Path, pages: dict[str, str | bytes]) -> SiteRoot:
+    """Write ``pages`` to the source directory of a new site, then index it."""
+    for name, content in pages.items():
+        path = root.joinpath("source", name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if isinstance(content, bytes):
+            path.write_bytes(content)
+        else:
+            path.write_text(content, encoding="utf-8")
+
+    site = SiteRoot(root)
+    TreeBuilder(site)
+    return site
+
+
+class BuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_footnotes_after_another_page(self):
+        site = make_site(self.root, {
+            "plain.md": "# Plain\n\nNo notes here.\n",
+            "notes.md": "# Notes\n\nA note.[^1]\n\n[^1]: The note.\n",
+        })
+        # Both built on this thread, so they share one renderer.
+        for name in ("plain.md", "notes.md"):
+            build(site.tree[site.source_dir.joinpath(name)])
+
+        html = site.dest_dir.joinpath("notes.html").read_text(encoding="utf-8")
+        self.assertIn("The note.", html)
+
+    def test_failed_page_is_rebuilt(self):
+        site = make_site(self.root, {"page.md": "# Page\n"})
+        source = site.source_dir.joinpath("page.md")
+        build_site(False, self.root, False, False, True, True)
+
+        # Fails to build, but is older than the output of the last build.
+        source.write_text("---\n[invalid\n---\n# Page\n", encoding="utf-8")
+        os.utime(source, ns=(0, 0))
+        with self.assertLogs("sitegen", logging.ERROR):
+            build_site(False, self.root, False, False, True, True)
+
+        site = make_site(self.root, {})
+        self.assertEqual(site.tree[source].build_reason, BuildReason.CHANGED)
+
+    def test_unreadable_directory_keeps_pages(self):
+        site = make_site(self.root, {"posts/page.md": "# Page\n"})
+        build_site(False, self.root, False, False, True, True)
+
+        posts = str(site.source_dir.joinpath("posts"))
+        scandir = os.scandir
+
+        def fail_on_posts(path):
+            if str(path) == posts:
+                raise PermissionError(13, "Permission denied", posts)
+            return scandir(path)
+
+        with mock.patch("os.scandir", fail_on_posts):
+            with self.assertLogs("sitegen", logging.WARNING):
+                build_site(False, self.root, False, False, True, True)
+
+        self.assertTrue(site.dest_dir.joinpath("posts", "page.html").exists())
+        self.assertIn("posts/page.md", SiteRoot(self.root).index_cache.entries)
+
+    def test_failure_keeps_traceback(self):
+        site = make_site(self.root, {"bad.md": "---\n[invalid\n---\n# Bad\n"})
+        failure, = build_all(list(site.tree))
+
+        self.assertIsNotNone(failure)
+        self.assertIn("Traceback", failure.traceback)
+        self.assertIn("load_metadata", failure.traceback)
+
+    def test_draft_is_skipped(self):
+        site = make_site(self.root, {
+            "draft.md": "---\nis_draft: true\n---\n# Draft\n",
+        })
+        context = site.tree[site.source_dir.joinpath("draft.md")]
+
+        self.assertFalse(build(context))
+        self.assertFalse(context.dest_path.exists())
+
+    def test_crlf_front_matter(self):
+        text = decode_source(b"---\r\nis_draft: true\r\n---\r\n# Draft\r\n")
+        self.assertEqual(split_front_matter(text), ("is_draft: true\n", "# Draft\n"))
+
+        site = make_site(self.root, {
+            "draft.md": b"---\r\nis_draft: true\r\n---\r\n# Draft\r\n",
+        })
+        self.assertFalse(build(site.tree[site.source_dir.joinpath("draft.md")]))
+
+    def test_empty_front_matter(self):
+        self.assertEqual(load_metadata("# Only a comment\n\n"), {})
+
+    def test_single_page_builds_without_pool(self):
+        site = make_site(self.root, {"page.md": "# Page\n"})
+        with mock.patch("sitegen.build.ProcessPoolExecutor") as executor_cls:
+            self.assertEqual(list(build_all(list(site.tree), max_workers=4)), [True])
+
+        executor_cls.assert_not_called()
+        self.assertTrue(site.dest_dir.joinpath("page.html").exists())
+
+    def test_pool_build(self):
+        site = make_site(self.root, {f"page{i}.md": f"# Page {i}\n" for i in range(3)})
+        self.assertEqual(list(build_all(list(site.tree), max_workers=2)), [True] * 3)
+
+    def test_published_page_made_draft(self):
+        site = make_site(self.root, {"page.md": "# Page\n"})
+        source = site.source_dir.joinpath("page.md")
+        dest = site.dest_dir.joinpath("page.html")
+        build_site(False, self.root, False, False, True, True)
+        self.assertTrue(dest.exists())
+
+        source.write_text("---\nis_draft: true\n---\n# Page\n", encoding="utf-8")
+        build_site(False, self.root, False, False, True, True)
+        self.assertFalse(dest.exists())
+
+        # Still checked on the next build, rather than taken as unchanged.
+        site = make_site(self.root, {})
+        self.assertNotIn("page.md", site.index_cache.entries)
+        self.assertEqual(site.tree[source].build_reason, BuildReason.CREATED)
+
+    def test_unreadable_build_directory(self):
+        site = make_site(self.root, {"posts/page.md": "# Page\n"})
+        build_site(False, self.root, False, False, True, True)
+
+        posts = str(site.dest_dir.joinpath("posts"))
+        scandir = os.scandir
+
+        def fail_on_posts(path):
+            if str(path) == posts:
+                raise PermissionError(13, "Permission denied", posts)
+            return scandir(path)
+
+        with mock.patch("os.scandir", fail_on_posts):
+            with self.assertLogs("sitegen", logging.WARNING):
+                site = make_site(self.root, {})
+
+        # Found by its own stat() instead.
+        context = site.tree[site.source_dir.joinpath("posts", "page.md")]
+        self.assertTrue(context.dest_exists)
+        self.assertEqual(context.build_reason, BuildReason.UNCHANGED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,30 @@
+import tempfile
+import unittest
+from pathlib import Path
+from sitegen.cache import stat_templates
+
+
+class StatTemplatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_stat_templates(self):
+        self.root.joinpath("partials").mkdir()
+        self.root.joinpath("page.html").write_text("page")
+        self.root.joinpath("partials", "nav.html").write_text("nav!")
+
+        stats = stat_templates(self.root)
+        self.assertEqual([s[:2] for s in stats], [["page.html", 4], ["partials/nav.html", 4]])
+        self.assertEqual(stats[0][2], self.root.joinpath("page.html").stat().st_mtime_ns)
+
+    def test_missing_directory(self):
+        self.assertEqual(stat_templates(self.root.joinpath("missing")), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
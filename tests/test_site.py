@@ -0,0 +1,44 @@
+import gc
+import pickle
+import tempfile
+import unittest
+import weakref
+from pathlib import Path
+from sitegen.build import get_page_template
+from sitegen.site import SiteRoot
+from sitegen.templates import PAGE_FALLBACK
+
+
+class SiteRootTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.root = Path(self.temp_dir.name)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_env_is_picklable(self):
+        # Sent to spawned worker processes, as on Windows and macOS.
+        env = pickle.loads(pickle.dumps(SiteRoot(self.root).env))
+        self.assertTrue(env.autoescape("page.html"))
+        self.assertTrue(env.autoescape("feed.XML"))
+        self.assertFalse(env.autoescape("robots.txt"))
+        self.assertFalse(env.autoescape(None))
+
+    def test_env_is_freed_after_template_lookup(self):
+        template_dir = self.root.joinpath("templates")
+        template_dir.mkdir()
+        template_dir.joinpath("page.html").write_text("{{ page.html }}")
+
+        env = SiteRoot(self.root).env
+        self.assertIsNot(get_page_template(env), PAGE_FALLBACK)
+        env_ref = weakref.ref(env)
+
+        del env
+        gc.collect()
+        self.assertIsNone(env_ref())
+
+
+if __name__ == "__main__":
+    unittest.main()